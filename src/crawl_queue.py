@@ -0,0 +1,525 @@
+"""
+crawl_queue.py
+
+여러 이벤트를 한꺼번에 긁을 때 쓰는 coordinator/worker 모드
+- coordinator: 이벤트 slug들을 작업(task)으로 쪼개서 로컬 SQLite 큐에 넣고 worker 프로세스 N개 실행
+- worker: 자기 토큰 + 자기 rate limit으로 작업을 가져가서 기존 get_* 함수 돌리고 결과를 큐에 다시 씀
+  (worker 안에서 스레드 몇 개가 limiter 하나 + singleflight 하나를 같이 씀)
+- worker가 죽으면 잡고 있던 작업은 다시 pending으로 돌아감 (lease 만료 or coordinator가 감지)
+
+작업 종류
+  event    : slug -> event id / 상태 조회, entrants 작업 추가
+  entrants : event id -> 전체 참가자 조회, 참가자마다 sets 작업 추가
+  sets     : (event id, entrant id) -> 해당 참가자 경기 목록 조회
+phase group 단위 작업은 따로 안 만듦: get_event_sets가 이벤트 전체에서 entrantIds로 거르니까
+모든 phase group 경기가 이미 들어오고, export(analyze_player_progress)도 참가자 단위라서
+phase group으로 또 나누면 같은 sets를 두 번 긁기만 함
+
+사용법
+  python src/crawl_queue.py run tournament/evo-2025/event/tekken-8 ... [--workers 4]
+  python src/crawl_queue.py worker --token XXX        # 다른 터미널/머신에서 worker만 추가 (coordinator랑 다른 토큰)
+  python src/crawl_queue.py export                    # sets 결과 -> csv
+토큰은 STARTGG_API_TOKENS(콤마 구분)에서 읽고, 없으면 STARTGG_API_TOKEN 하나만 씀
+"""
+import os
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+import multiprocessing as mp
+from typing import List, Dict, Any, Optional, Tuple
+
+import requests
+import pandas as pd
+from dotenv import load_dotenv
+
+from singleflight import coalesce
+
+load_dotenv()
+
+DB_PATH = "data/crawl_queue.db"
+LEASE_SECS = 600        # 이 시간 안에 안 끝나면 worker가 죽은 걸로 보고 다시 큐에 넣음
+MAX_ATTEMPTS = 5
+MAX_RESPAWNS = 5        # worker 하나당 비정상 종료 후 재시작 횟수 제한
+WORKER_THREADS = 4      # worker 프로세스 하나 안에서 동시에 돌리는 작업 수
+# start.gg 기본 제한: 토큰당 80 req / 60s
+RATE_REQUESTS = 80
+RATE_PERIOD = 60.0
+REQUEST_TIMEOUT = 30    # 연결 멈추면 worker가 영원히 안 끝나서 timeout 필수
+REQUEST_RETRIES = 5     # 429/5xx/네트워크 에러는 작업 실패 전에 여기서 먼저 재시도
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 60.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind        TEXT NOT NULL,
+    payload     TEXT NOT NULL,
+    status      TEXT NOT NULL DEFAULT 'pending',
+    worker      TEXT,
+    lease_until REAL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    result      TEXT,
+    error       TEXT,
+    UNIQUE (kind, payload)
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, id);
+"""
+
+
+def connect(db_path: str = DB_PATH) -> sqlite3.Connection:
+    # isolation_level=None -> 트랜잭션은 직접 BEGIN IMMEDIATE로 잡음 (claim 경쟁 방지)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, sort_keys=True, ensure_ascii=False)
+
+
+def _insert_tasks(conn: sqlite3.Connection, tasks: List[Dict[str, Any]]) -> None:
+    # 같은 (kind, payload)는 한 번만 -> coordinator 다시 돌려도 중복 안 생김
+    conn.executemany(
+        "INSERT OR IGNORE INTO tasks (kind, payload) VALUES (?, ?)",
+        [(t["kind"], _dumps(t["payload"])) for t in tasks],
+    )
+
+
+def enqueue(conn: sqlite3.Connection, tasks: List[Dict[str, Any]]) -> None:
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        _insert_tasks(conn, tasks)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def claim(conn: sqlite3.Connection, worker: str) -> Optional[Dict[str, Any]]:
+    """
+    pending 작업 하나 가져오기. lease 만료된 running 작업도 여기서 같이 회수
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        requeue_expired(conn, now)
+        row = conn.execute(
+            "SELECT id, kind, payload, attempts FROM tasks WHERE status = 'pending' ORDER BY id LIMIT 1"
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE tasks SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+            (worker, now + LEASE_SECS, row[0]),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return {"id": row[0], "kind": row[1], "payload": json.loads(row[2]), "attempts": row[3] + 1}
+
+
+def complete(conn: sqlite3.Connection, task_id: int, worker: str, result: Any, children: List[Dict[str, Any]]) -> bool:
+    """
+    결과 저장이랑 후속 작업 추가를 한 트랜잭션으로 -> "pending/running 없음" = 진짜 끝
+    lease 만료돼서 다른 worker한테 넘어간 작업이면 결과 버리고 False
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cur = conn.execute(
+            "UPDATE tasks SET status = 'done', result = ?, error = NULL, lease_until = NULL "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (_dumps(result), task_id, worker),
+        )
+        if cur.rowcount == 0:
+            conn.execute("ROLLBACK")
+            return False
+        _insert_tasks(conn, children)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return True
+
+
+def fail(conn: sqlite3.Connection, task_id: int, worker: str, error: str) -> bool:
+    # MAX_ATTEMPTS 넘으면 failed, 아니면 다시 pending. 이미 남의 작업이 됐으면 안 건드림
+    cur = conn.execute(
+        """
+        UPDATE tasks
+        SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+            worker = NULL, lease_until = NULL, error = ?
+        WHERE id = ? AND worker = ? AND status = 'running'
+        """,
+        (MAX_ATTEMPTS, error, task_id, worker),
+    )
+    return cur.rowcount > 0
+
+
+# 회수할 때도 fail()이랑 같은 규칙: MAX_ATTEMPTS 넘으면 failed (worker 계속 죽이는 작업 무한 반복 방지)
+REQUEUE_SQL = """
+UPDATE tasks
+SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+    worker = NULL, lease_until = NULL, error = ?
+WHERE status = 'running' AND {cond}
+"""
+
+
+def requeue_expired(conn: sqlite3.Connection, now: float = None) -> int:
+    now = time.time() if now is None else now
+    cur = conn.execute(
+        REQUEUE_SQL.format(cond="lease_until < ?"),
+        (MAX_ATTEMPTS, "lease expired", now),
+    )
+    return cur.rowcount
+
+
+def requeue_worker(conn: sqlite3.Connection, worker: str) -> int:
+    """
+    죽은 worker가 잡고 있던 작업 다시 pending으로
+    """
+    # 스레드는 "<worker>/t0" 식 이름으로 작업을 잡음
+    cur = conn.execute(
+        REQUEUE_SQL.format(cond="(worker = ? OR substr(worker, 1, ?) = ?)"),
+        (MAX_ATTEMPTS, f"worker {worker} died", worker, len(worker) + 1, worker + "/"),
+    )
+    return cur.rowcount
+
+
+def requeue_prefix(conn: sqlite3.Connection, prefix: str) -> int:
+    """
+    이름이 prefix로 시작하는 worker 작업 전부 회수 (coordinator 재시작할 때 지난 실행 작업 정리용)
+    """
+    cur = conn.execute(
+        REQUEUE_SQL.format(cond="substr(worker, 1, ?) = ?"),
+        (MAX_ATTEMPTS, "coordinator restarted", len(prefix), prefix),
+    )
+    return cur.rowcount
+
+
+def count_by_status(conn: sqlite3.Connection) -> Dict[str, int]:
+    rows = conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+    return {status: n for status, n in rows}
+
+
+def is_finished(conn: sqlite3.Connection) -> bool:
+    counts = count_by_status(conn)
+    return counts.get("pending", 0) == 0 and counts.get("running", 0) == 0
+
+
+class RateLimiter:
+    """
+    토큰 하나당 period초 동안 max_requests번까지만 (sliding window)
+    """
+    def __init__(self, max_requests: int = RATE_REQUESTS, period: float = RATE_PERIOD):
+        self.max_requests = max_requests
+        self.period = period
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self.sent = [t for t in self.sent if now - t < self.period]
+                if len(self.sent) < self.max_requests:
+                    self.sent.append(now)
+                    return
+                time.sleep(self.period - (now - self.sent[0]))
+
+
+class RetryableError(Exception):
+    def __init__(self, message: str, response: Optional[requests.Response] = None):
+        super().__init__(message)
+        self.response = response
+
+
+def _backoff(attempt: int, response: Optional[requests.Response] = None) -> float:
+    # Retry-After(초) 있으면 그거 따르고, 없으면 2, 4, 8 ... 최대 60초
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return float(retry_after)
+    return min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+
+
+def raising_query(mod, limiter: RateLimiter):
+    """
+    worker용 run_graphql_query: 429/5xx/네트워크 에러는 backoff 하면서 재시도, 그래도 안 되면 예외
+    (matches.run_graphql_query는 5번 실패하면 {} 돌려줘서 빈 결과가 done으로 저장됨 -> fail()로 보내서 재시도)
+    재시도도 rate 먹으니까 limiter는 요청 보낼 때마다 통과
+    """
+    def post_once(payload: Dict[str, Any]) -> Dict[str, Any]:
+        limiter.wait()
+        try:
+            response = requests.post(mod.STARTGG_API, json=payload, headers=mod.HEADERS, timeout=REQUEST_TIMEOUT)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            raise RetryableError(repr(e))
+        if response.status_code == 429 or response.status_code >= 500:
+            raise RetryableError(f"HTTP {response.status_code}", response)
+        response.raise_for_status()
+        data = response.json()
+        if not data.get("data"):
+            errors = data.get("errors")
+            # start.gg는 rate limit을 200 + errors로 줄 때도 있음
+            if "rate limit" in str(errors).lower():
+                raise RetryableError(f"rate limit: {errors}", response)
+            raise RuntimeError(f"GraphQL 응답에 data 없음: {errors}")
+        return data
+
+    def run_graphql_query(query: str, variables: Dict[str, Any] = None) -> Dict[str, Any]:
+        payload = {"query": query}
+        if variables:
+            payload["variables"] = variables
+        for attempt in range(REQUEST_RETRIES):
+            try:
+                return post_once(payload)
+            except RetryableError as e:
+                if attempt == REQUEST_RETRIES - 1:
+                    raise RuntimeError(f"GraphQL {REQUEST_RETRIES}번 다 실패: {e}") from e
+                wait = _backoff(attempt, e.response)
+                print(f"GraphQL 재시도 {attempt + 1}/{REQUEST_RETRIES - 1} ({e}), {wait:.0f}초 대기")
+                time.sleep(wait)
+    return run_graphql_query
+
+
+def setup_client(token: str, limiter: RateLimiter) -> None:
+    """
+    이 프로세스의 기존 fetcher들이 token + limiter를 쓰도록 세팅
+    (worker는 프로세스가 따로라서 모듈 전역 HEADERS 바꿔도 다른 worker랑 안 섞임)
+    limiter는 raising_query 안(coalesce 안쪽) -> worker 스레드끼리 겹친 요청은 rate 안 먹음 (프로세스 사이는 못 합침)
+    """
+    import main
+    import matches
+    for mod in (main, matches):
+        mod.HEADERS["Authorization"] = f"Bearer {token}"
+        mod.run_graphql_query = coalesce(
+            raising_query(mod, limiter),
+            scope=lambda mod=mod: (mod.STARTGG_API, mod.HEADERS.get("Authorization")),
+        )
+
+
+def run_task(task: Dict[str, Any]) -> Tuple[Any, List[Dict[str, Any]]]:
+    """
+    작업 하나 실행 -> (결과, 후속 작업 리스트)
+    """
+    from main import get_event_info, get_event_status, get_entrants
+    from matches import get_event_sets
+
+    kind = task["kind"]
+    payload = task["payload"]
+    if kind == "event":
+        info = get_event_info(payload["slug"])
+        if not info or "id" not in info:
+            raise ValueError(f"이벤트 ID를 찾을 수 없음: {payload['slug']}")
+        event_id = int(info["id"])
+        status = get_event_status(event_id)
+        result = {
+            "slug": payload["slug"],
+            "id": event_id,
+            "name": status.get("name"),
+            "state": status.get("state"),
+            "numEntrants": status.get("numEntrants"),
+        }
+        return result, [{"kind": "entrants", "payload": {"event_id": event_id}}]
+    if kind == "entrants":
+        event_id = payload["event_id"]
+        entrants = get_entrants(event_id)
+        children = [
+            {
+                "kind": "sets",
+                "payload": {"event_id": event_id, "entrant_id": int(e["id"]), "name": e.get("name")},
+            }
+            for e in entrants
+        ]
+        return entrants, children
+    if kind == "sets":
+        return get_event_sets(payload["event_id"], payload["entrant_id"]), []
+    raise ValueError(f"모르는 작업 종류: {kind}")
+
+
+def worker_loop(token: str, name: str, db_path: str = DB_PATH, share: int = 1,
+                threads: int = WORKER_THREADS, idle_sleep: float = 2.0) -> None:
+    """
+    스레드 threads개로 작업 동시에 돌림 (limiter, singleflight는 프로세스 안에서 공유)
+    share: 같은 토큰 쓰는 worker 수 -> 토큰 rate를 그만큼 나눠서 씀
+    """
+    setup_client(token, RateLimiter(max(1, RATE_REQUESTS // share)))
+    print(f"[{name}] 시작 (스레드 {threads}개)")
+    ts = [
+        threading.Thread(target=_worker_thread, args=(f"{name}/t{i}", db_path, idle_sleep), daemon=True)
+        for i in range(threads)
+    ]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    print(f"[{name}] 끝")
+
+
+def _worker_thread(name: str, db_path: str, idle_sleep: float) -> None:
+    """
+    작업 없고 running도 없으면 종료. 다른 스레드/worker가 작업 추가할 수 있으니 running 있으면 대기
+    """
+    conn = connect(db_path)  # sqlite 연결은 스레드마다 따로
+    while True:
+        task = claim(conn, name)
+        if task is None:
+            if is_finished(conn):
+                break
+            time.sleep(idle_sleep)
+            continue
+        try:
+            result, children = run_task(task)
+        except Exception as e:
+            print(f"[{name}] {task['kind']} {task['payload']} 실패({task['attempts']}회): {e}")
+            if not fail(conn, task["id"], name, repr(e)):
+                print(f"[{name}] lease 만료로 이미 다른 worker 작업이라 무시")
+            continue
+        if not complete(conn, task["id"], name, result, children):
+            print(f"[{name}] {task['kind']} {task['payload']} lease 만료로 결과 버림")
+            continue
+        print(f"[{name}] {task['kind']} {task['payload']} 완료 (+{len(children)})")
+    conn.close()
+
+
+def load_tokens() -> List[str]:
+    tokens = os.getenv("STARTGG_API_TOKENS") or os.getenv("STARTGG_API_TOKEN") or ""
+    return [t.strip() for t in tokens.split(",") if t.strip()]
+
+
+def coordinator(event_slugs: List[str], tokens: List[str], num_workers: int, db_path: str = DB_PATH,
+                threads: int = WORKER_THREADS) -> None:
+    """
+    slug들 큐에 넣고 worker 띄운 다음 다 끝날 때까지 감시
+    worker 하나당 토큰 하나 (토큰보다 worker가 많으면 돌려씀 -> 같은 토큰 쓰는 worker끼리 rate 나눠씀)
+    """
+    if not tokens:
+        print("토큰이 없음. STARTGG_API_TOKENS 또는 STARTGG_API_TOKEN 설정하시오")
+        return
+    conn = connect(db_path)
+    enqueue(conn, [{"kind": "event", "payload": {"slug": slug}} for slug in event_slugs])
+
+    host = socket.gethostname()
+    # 지난번에 끊긴 실행의 running 작업 (이 호스트 -w 이름은 coordinator만 씀) -> lease 기다릴 필요 없이 바로 회수
+    n = requeue_prefix(conn, f"{host}-w")
+    if n:
+        print(f"[coordinator] 지난 실행에서 남은 작업 {n}개 다시 큐에 넣음")
+    procs = {}
+    tokens_by_name = {}
+    respawns = {}
+
+    def spawn(name: str) -> None:
+        token = tokens_by_name[name]
+        share = list(tokens_by_name.values()).count(token)
+        p = mp.Process(target=worker_loop, args=(token, name, db_path, share, threads), daemon=True)
+        p.start()
+        procs[name] = p
+
+    # 토큰 배정 먼저 다 끝내고 띄워야 share 계산이 맞음
+    for i in range(num_workers):
+        tokens_by_name[f"{host}-w{i}"] = tokens[i % len(tokens)]
+    for name in tokens_by_name:
+        spawn(name)
+
+    while True:
+        time.sleep(5)
+        for name, p in list(procs.items()):
+            if p.is_alive():
+                continue
+            n = requeue_worker(conn, name)
+            del procs[name]
+            if p.exitcode == 0:
+                continue
+            respawns[name] = respawns.get(name, 0) + 1
+            if respawns[name] > MAX_RESPAWNS:
+                print(f"[coordinator] {name} 죽음(exitcode={p.exitcode}), 재시작 {MAX_RESPAWNS}번 넘어서 포기")
+                continue
+            print(f"[coordinator] {name} 죽음(exitcode={p.exitcode}), 작업 {n}개 다시 큐에 넣고 재시작")
+            spawn(name)
+        requeue_expired(conn)
+        if is_finished(conn):
+            break
+        if not procs:
+            # 다 정상 종료했는데 lease 만료로 돌아온 작업이 남은 경우 (재시작 다 쓴 worker는 빼고)
+            alive = [name for name in tokens_by_name if respawns.get(name, 0) <= MAX_RESPAWNS]
+            if not alive:
+                print("[coordinator] 살아있는 worker가 없어서 중단. 남은 작업은 worker 명령으로 이어서 돌리시오")
+                break
+            for name in alive:
+                spawn(name)
+    for p in procs.values():
+        p.join()
+    print("[coordinator] 완료:", count_by_status(conn))
+    conn.close()
+
+
+def export_progress(db_path: str = DB_PATH, out_dir: str = "data") -> None:
+    """
+    sets 결과를 analyze_player_progress로 돌려서 이벤트마다 csv 저장
+    """
+    from matches import analyze_player_progress
+
+    conn = connect(db_path)
+    events = {}
+    for payload, result in conn.execute("SELECT payload, result FROM tasks WHERE kind = 'event' AND status = 'done'"):
+        info = json.loads(result)
+        events[info["id"]] = json.loads(payload)["slug"]
+
+    rows_by_event = {}
+    for payload, result in conn.execute("SELECT payload, result FROM tasks WHERE kind = 'sets' AND status = 'done'"):
+        p = json.loads(payload)
+        sets = json.loads(result)
+        if not sets:
+            continue
+        progress = analyze_player_progress(sets, p["name"], p["entrant_id"])
+        rows_by_event.setdefault(p["event_id"], []).append(progress)
+    conn.close()
+
+    for event_id, rows in rows_by_event.items():
+        slug = events.get(event_id, str(event_id))
+        # tournament/evo-2025/event/tekken-8 -> evo-2025_tekken-8
+        parts = slug.split("/")
+        file_name = f"{out_dir}/{parts[1]}_{parts[3]}.csv" if len(parts) >= 4 else f"{out_dir}/{slug}.csv"
+        pd.DataFrame(rows).to_csv(file_name, index=False, encoding="utf-8")
+        print(f"{file_name} 저장 완료! ({len(rows)}명)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="start.gg 여러 worker로 크롤링")
+    parser.add_argument("--db", default=DB_PATH)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_run = sub.add_parser("run", help="coordinator + worker 실행")
+    p_run.add_argument("slugs", nargs="+", help="tournament/xxx/event/yyy")
+    p_run.add_argument("--workers", type=int, default=0, help="기본값: 토큰 개수")
+    p_run.add_argument("--threads", type=int, default=WORKER_THREADS, help="worker 하나당 스레드 수")
+
+    p_worker = sub.add_parser("worker", help="worker 하나만 실행 (이미 큐가 있을 때)")
+    p_worker.add_argument("--token", required=True, help="coordinator가 안 쓰는 토큰 (같은 토큰이면 --share 같이)")
+    p_worker.add_argument("--share", type=int, default=1, help="이 토큰 쓰는 worker 수 (rate 나눠씀)")
+    p_worker.add_argument("--name", default=f"{socket.gethostname()}-{os.getpid()}")
+    p_worker.add_argument("--threads", type=int, default=WORKER_THREADS)
+
+    sub.add_parser("status", help="큐 상태 보기")
+    sub.add_parser("export", help="sets 결과 csv로 저장")
+
+    args = parser.parse_args()
+    if args.cmd == "run":
+        tokens = load_tokens()
+        coordinator(args.slugs, tokens, args.workers or len(tokens), args.db, args.threads)
+    elif args.cmd == "worker":
+        worker_loop(args.token, args.name, args.db, args.share, args.threads)
+    elif args.cmd == "status":
+        print(count_by_status(connect(args.db)))
+    elif args.cmd == "export":
+        export_progress(args.db)
+
+
+if __name__ == "__main__":
+    main()
@@ -19,6 +19,7 @@ import time, pprint
 
 # 딴 파일에서 들고왓
 from matches import get_event_sets, analyze_player_progress
+from singleflight import coalesce
 
 load_dotenv()
 PAT = os.getenv("STARTGG_API_TOKEN")
@@ -31,6 +32,7 @@ HEADERS = {
     "Authorization": f"Bearer {PAT}",
 }
 
+@coalesce
 def run_graphql_query(query: str, variables: Dict[str, Any] = None) -> Dict[str, Any]:
     payload = {"query": query}
     if variables:
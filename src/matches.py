@@ -5,6 +5,8 @@ from dotenv import load_dotenv
 
 import time
 
+from singleflight import coalesce
+
 # 환경 변수에서 PAT 불러오기
 load_dotenv()
 PAT = os.getenv("STARTGG_API_TOKEN")
@@ -15,6 +17,7 @@ HEADERS = {
     "Authorization": f"Bearer {PAT}",
 }
 
+@coalesce
 def run_graphql_query(query: str, variables: Dict[str, Any] = None) -> Dict[str, Any]:
     payload = {"query": query}
     if variables:
@@ -10,6 +10,8 @@ import requests
 import pandas as pd
 from dotenv import load_dotenv
 
+from singleflight import coalesce
+
 load_dotenv()
 PAT = os.getenv("STARTGG_API_TOKEN")
 STARTGG_API = "https://api.start.gg/gql/alpha"
@@ -19,6 +21,7 @@ HEADERS = {
     "Authorization": f"Bearer {PAT}",
 }
 
+@coalesce
 def run_graphql_query(query: str, variables: Dict[str, Any] = None) -> Dict[str, Any]:
     payload = {"query": query}
     if variables:
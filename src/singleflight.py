@@ -0,0 +1,78 @@
+"""
+singleflight.py
+
+같은 (query, variables) 요청이 이미 날아가는 중이면 새로 안 보내고 그 결과를 같이 받음
+TTL 캐시랑 달리 첫 응답이 오기 전에 들어온 중복 요청을 잡는 용도 (응답 오면 바로 잊음)
+"""
+import copy
+import json
+import threading
+import functools
+from typing import Dict, Any, Callable, Tuple
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.waiters = 0
+        self.result = None
+        self.error = None
+
+
+# main/players/matches 어디서 부르든 같은 요청이면 합쳐지도록 모듈 하나에 하나만
+_lock = threading.Lock()
+_in_flight: Dict[str, _Call] = {}
+
+
+def _module_scope(func) -> Callable[[], Tuple[Any, Any]]:
+    # 데코레이트한 함수 모듈의 STARTGG_API / HEADERS를 호출할 때마다 읽음 (worker가 토큰 바꿔도 반영)
+    g = func.__globals__
+    return lambda: (g.get("STARTGG_API"), g.get("HEADERS", {}).get("Authorization"))
+
+
+def coalesce(func=None, *, scope: Callable[[], Tuple[Any, Any]] = None):
+    """
+    run_graphql_query(query, variables) 데코레이터
+    먼저 온 스레드가 실제 요청, 나머지는 기다렸다가 같은 결과(복사본)/같은 예외 받음
+    키 = (endpoint, Authorization, query, variables) -> 토큰 다르면 절대 안 합침
+    scope: (endpoint, Authorization) 돌려주는 함수. 없으면 func 모듈의 STARTGG_API / HEADERS
+    variables가 json으로 안 바뀌면 TypeError (다른 요청이 같은 키로 합쳐지는 것보다 나음)
+    """
+    if func is None:
+        return lambda f: coalesce(f, scope=scope)
+    scope = scope or _module_scope(func)
+
+    @functools.wraps(func)
+    def wrapper(query: str, variables: Dict[str, Any] = None) -> Dict[str, Any]:
+        key = json.dumps([*scope(), query, variables or {}], sort_keys=True)
+        with _lock:
+            call = _in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = _in_flight[key] = _Call()
+            else:
+                call.waiters += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+        try:
+            result = func(query, variables)
+        except BaseException as e:
+            # KeyboardInterrupt 같은 건 기다리는 쪽한테 그대로 던지지 말고 따로 에러로
+            call.error = e if isinstance(e, Exception) else RuntimeError(f"같은 요청 보낸 쪽이 중단됨: {e!r}")
+            with _lock:
+                del _in_flight[key]
+            call.done.set()
+            raise
+        with _lock:
+            del _in_flight[key]
+            shared = call.waiters > 0
+        # 기다리는 쪽 있을 때만 스냅샷 복사 (리더가 자기 결과를 고쳐도 안전)
+        if shared:
+            call.result = copy.deepcopy(result)
+        call.done.set()
+        return result
+
+    return wrapper
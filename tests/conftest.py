@@ -0,0 +1,5 @@
+import os
+import sys
+
+# src/ 모듈들이 서로 import main, import matches 식으로 불러서 경로만 추가
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
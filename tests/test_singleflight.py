@@ -0,0 +1,166 @@
+import threading
+import time
+
+import pytest
+import requests
+
+import main
+import players
+import singleflight
+from singleflight import coalesce
+
+
+class FakeResponse:
+    status_code = 200
+    headers = {}
+
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+@pytest.fixture
+def gate(monkeypatch):
+    """
+    requests.post를 막아두고 release() 할 때까지 대기시키는 stub
+    """
+    calls = []
+    release = threading.Event()
+
+    def fake_post(url, json=None, headers=None, **kwargs):
+        calls.append(headers["Authorization"])
+        release.wait(5)
+        return FakeResponse({"data": {"event": {"id": "7", "name": "evo"}}})
+
+    monkeypatch.setattr(requests, "post", fake_post)
+    return calls, release
+
+
+def wait_until(cond, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < end, "timeout"
+        time.sleep(0.01)
+
+
+def waiting_calls():
+    with singleflight._lock:
+        return sum(call.waiters for call in singleflight._in_flight.values())
+
+
+def run_threads(*targets):
+    out = {}
+    ts = [threading.Thread(target=lambda i=i, f=f: out.__setitem__(i, f())) for i, f in enumerate(targets)]
+    for t in ts:
+        t.start()
+    return ts, out
+
+
+def test_same_query_from_different_modules_is_one_request(gate):
+    calls, release = gate
+    ts, out = run_threads(lambda: main.get_event_info("s"), lambda: players.get_event_id("s"))
+    wait_until(lambda: waiting_calls() == 1)
+    release.set()
+    for t in ts:
+        t.join()
+    assert len(calls) == 1
+    assert out == {0: {"id": "7", "name": "evo"}, 1: 7}
+
+
+def test_different_tokens_are_not_merged(gate, monkeypatch):
+    calls, release = gate
+    monkeypatch.setitem(players.HEADERS, "Authorization", "Bearer other")
+    ts, out = run_threads(lambda: main.get_event_info("s"), lambda: players.get_event_id("s"))
+    wait_until(lambda: len(calls) == 2)
+    release.set()
+    for t in ts:
+        t.join()
+    assert sorted(calls) == sorted([main.HEADERS["Authorization"], "Bearer other"])
+
+
+def test_waiters_get_a_copy_not_the_leaders_object(gate):
+    calls, release = gate
+    ts, out = run_threads(lambda: main.run_graphql_query("q"), lambda: main.run_graphql_query("q"))
+    wait_until(lambda: waiting_calls() == 1)
+    release.set()
+    for t in ts:
+        t.join()
+    assert len(calls) == 1
+    assert out[0] == out[1]
+    assert out[0] is not out[1]
+
+
+def make_blocking(exc):
+    release = threading.Event()
+    calls = []
+
+    @coalesce(scope=lambda: ("test", None))
+    def query(q, variables=None):
+        calls.append(q)
+        release.wait(5)
+        raise exc
+
+    return query, release, calls
+
+
+def test_leader_exception_is_raised_in_waiters():
+    query, release, calls = make_blocking(ValueError("boom"))
+    errors = []
+
+    def call():
+        try:
+            query("err")
+        except ValueError as e:
+            errors.append(e)
+
+    ts = [threading.Thread(target=call) for _ in range(3)]
+    for t in ts:
+        t.start()
+    wait_until(lambda: waiting_calls() == 2)
+    release.set()
+    for t in ts:
+        t.join()
+    assert len(calls) == 1
+    assert len(errors) == 3
+
+
+def test_aborted_leader_gives_waiters_runtime_error():
+    query, release, calls = make_blocking(KeyboardInterrupt())
+    got = []
+
+    def leader():
+        try:
+            query("abort")
+        except KeyboardInterrupt:
+            got.append("leader")
+
+    def waiter():
+        try:
+            got.append(query("abort"))
+        except RuntimeError:
+            got.append("waiter")
+
+    t1 = threading.Thread(target=leader)
+    t1.start()
+    wait_until(lambda: len(calls) == 1)
+    t2 = threading.Thread(target=waiter)
+    t2.start()
+    wait_until(lambda: waiting_calls() == 1)
+    release.set()
+    t1.join()
+    t2.join()
+    assert sorted(got) == ["leader", "waiter"]
+
+
+def test_unserializable_variables_fail_loudly():
+    @coalesce(scope=lambda: ("test", None))
+    def query(q, variables=None):
+        return {}
+
+    with pytest.raises(TypeError):
+        query("q", {"x": object()})